@@ -1,12 +1,22 @@
 import os
 import logging
 from flask import Flask
+from flask.json.provider import JSONProvider
+from flask_caching import Cache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from apscheduler.events import EVENT_JOB_EXECUTED
+from apscheduler.executors.pool import ProcessPoolExecutor, ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from werkzeug.serving import is_running_from_reloader
 import atexit
+import multiprocessing
+import sys
+import orjson
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -14,10 +24,24 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, which encodes datetimes natively"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 db = SQLAlchemy(model_class=Base)
 
 # create the app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
@@ -26,31 +50,116 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    # Room for concurrent API requests plus scheduler jobs; LIFO keeps a
+    # small set of connections warm instead of cycling through all of them
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_use_lifo": True,
+    # Batch size for multi-row INSERT ... VALUES used by bulk inserts
+    "insertmanyvalues_page_size": 1000,
 }
+if (os.environ.get("DATABASE_URL") or "").startswith("postgres"):
+    # Fail runaway queries and abandoned transactions instead of holding connections
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {
+        "options": "-c statement_timeout=5000 -c idle_in_transaction_session_timeout=10000"
+    }
+
+# cache read-only API responses between scheduled data updates
+app.config["CACHE_TYPE"] = "RedisCache" if os.environ.get("REDIS_URL") else "SimpleCache"
+app.config["CACHE_REDIS_URL"] = os.environ.get("REDIS_URL")
+app.config["CACHE_DEFAULT_TIMEOUT"] = 120
 
-# initialize the app with the extension
+# initialize the app with the extensions
 db.init_app(app)
+cache = Cache(app)
 
 # Import routes after app initialization
 from routes import *  # noqa: F401, F403
 
+# Register the model tables even when routes is only partially imported
+# (app.py run as __main__ re-imports itself as 'app' from routes)
+import models  # noqa: F401, E402
+
 with app.app_context():
-    # Create tables
-    db.create_all()
+    with db.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Index builds on existing tables can outlast the statement timeout
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+            # Required by the trigram index on earthquakes.region
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        
+        # Create tables
+        db.metadata.create_all(bind=conn)
+        
+        if conn.dialect.name == "postgresql":
+            # create_all() doesn't add new columns to existing tables either
+            earthquakes = db.metadata.tables["earthquakes"]
+            for column in (earthquakes.c.lat_cell_2deg, earthquakes.c.lon_cell_2deg):
+                column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE earthquakes ADD COLUMN IF NOT EXISTS {column_ddl}"))
+        
+        # create_all() skips existing tables, so add indexes declared since then
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        
+        # Drop indexes superseded by idx_ts_mag, idx_region_trgm and idx_ts_cells
+        for index_name in ("idx_magnitude", "idx_timestamp", "idx_region", "idx_cells"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+def init_fetch_worker():
+    """Drop connections inherited from the web process in a forked fetch worker"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+    from earthquake_service import earthquake_service
+    earthquake_service.reset_session()
 
-# Initialize background scheduler for data fetching
-scheduler = BackgroundScheduler()
+# Initialize background scheduler for data fetching; each job runs at most
+# once at a time and missed runs collapse into a single catch-up run
+scheduler = BackgroundScheduler(
+    executors={
+        'default': ThreadPoolExecutor(max_workers=2),
+        # Fetches run in a separate process so parsing and inserting don't
+        # compete with request handlers for the GIL. Workers are forked so
+        # they reuse the loaded app instead of re-importing this module.
+        'process': ProcessPoolExecutor(max_workers=1, pool_kwargs={
+            'mp_context': multiprocessing.get_context('fork'),
+            'initializer': init_fetch_worker
+        })
+    },
+    job_defaults={
+        'coalesce': True,
+        'max_instances': 1,
+        'misfire_grace_time': 300
+    }
+)
 
 def fetch_earthquake_data():
     """Background task to fetch earthquake data from USGS API"""
     with app.app_context():
         try:
-            from earthquake_service import EarthquakeService
-            service = EarthquakeService()
-            count = service.fetch_and_store_earthquakes()
+            from earthquake_service import earthquake_service
+            count = earthquake_service.fetch_and_store_earthquakes()
             app.logger.info(f"Fetched {count} new earthquakes")
+            return count
         except Exception as e:
             app.logger.error(f"Error fetching earthquake data: {e}")
+            return 0
+
+def clear_cache_after_fetch(event):
+    """Invalidate this process's API cache once the fetch worker stores new data"""
+    if event.job_id == 'fetch_earthquakes' and event.retval:
+        cache.clear()
+
+def update_risk_zones():
+    """Background task to recalculate earthquake risk zones"""
+    with app.app_context():
+        try:
+            from prediction_service import PredictionService
+            zones = PredictionService().update_risk_zones()
+            app.logger.info(f"Updated {zones} risk zones")
+        except Exception as e:
+            app.logger.error(f"Error updating risk zones: {e}")
 
 # Schedule earthquake data fetching every 30 minutes
 scheduler.add_job(
@@ -58,14 +167,38 @@ scheduler.add_job(
     trigger=IntervalTrigger(minutes=30),
     id='fetch_earthquakes',
     name='Fetch earthquake data from USGS',
+    executor='process',
+    replace_existing=True
+)
+scheduler.add_listener(clear_cache_after_fetch, EVENT_JOB_EXECUTED)
+
+# Schedule risk zone recalculation every hour
+scheduler.add_job(
+    func=update_risk_zones,
+    trigger=IntervalTrigger(hours=1),
+    id='update_risk_zones',
+    name='Recalculate earthquake risk zones',
     replace_existing=True
 )
 
-# Start the scheduler
-scheduler.start()
+def should_start_scheduler():
+    """Start exactly one scheduler per server, however this module was loaded"""
+    if __name__ == '__main__':
+        # `python app.py` imports this module again as 'app' from routes;
+        # that copy owns the scheduler
+        return False
+    main_file = getattr(sys.modules.get('__main__'), '__file__', None)
+    if main_file and os.path.abspath(main_file) == os.path.abspath(__file__):
+        # Under the debug reloader, skip the file-watching parent process
+        return is_running_from_reloader()
+    return True
 
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
+if should_start_scheduler():
+    # Start the scheduler
+    scheduler.start()
+    
+    # Shut down the scheduler when exiting the app
+    atexit.register(lambda: scheduler.shutdown())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,7 +1,12 @@
 import requests
 import logging
+import ijson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
-from app import db
+from sqlalchemy import and_, func, insert
+from sqlalchemy.exc import DataError, IntegrityError
+from app import db, cache
 from models import Earthquake
 
 class EarthquakeService:
@@ -9,8 +14,28 @@ class EarthquakeService:
     
     USGS_API_BASE = "https://earthquake.usgs.gov/fdsnws/event/1/query"
     
+    # Features handled per duplicate lookup and INSERT; keeps IN (...) lists
+    # below database bind parameter limits and bounds memory while streaming
+    BATCH_SIZE = 1000
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        self.reset_session()
+    
+    def reset_session(self):
+        """Start a new HTTP session, e.g. in a forked process"""
+        # Reuse keep-alive connections to the USGS API across fetches
+        self.session = requests.Session()
+        retries = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504]
+        )
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=retries
+        ))
     
     def fetch_and_store_earthquakes(self, days=7, min_magnitude=2.0):
         """
@@ -39,63 +64,31 @@ class EarthquakeService:
             
             self.logger.info(f"Fetching earthquakes from {start_time} to {end_time}")
             
-            # Make API request
-            response = requests.get(self.USGS_API_BASE, params=params, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
-            features = data.get('features', [])
-            
+            # Make API request, decoding features as they arrive. Each batch
+            # is committed on its own so no transaction sits idle while the
+            # next part of the feed downloads.
             new_count = 0
             
-            for feature in features:
-                try:
-                    # Extract earthquake data
-                    properties = feature['properties']
-                    geometry = feature['geometry']
-                    
-                    usgs_id = feature['id']
-                    magnitude = properties.get('mag')
-                    region = properties.get('place', 'Unknown')
-                    timestamp = datetime.fromtimestamp(properties['time'] / 1000)
-                    
-                    coordinates = geometry['coordinates']
-                    longitude = coordinates[0]
-                    latitude = coordinates[1]
-                    depth = coordinates[2] if len(coordinates) > 2 else 0
-                    
-                    # Check if earthquake already exists
-                    existing = Earthquake.query.filter_by(usgs_id=usgs_id).first()
-                    if existing:
-                        continue
-                    
-                    # Create new earthquake record
-                    earthquake = Earthquake(
-                        usgs_id=usgs_id,
-                        latitude=latitude,
-                        longitude=longitude,
-                        magnitude=magnitude,
-                        depth=depth,
-                        region=region,
-                        timestamp=timestamp
-                    )
-                    
-                    db.session.add(earthquake)
-                    new_count += 1
-                    
-                except Exception as e:
-                    self.logger.error(f"Error processing earthquake feature: {e}")
-                    db.session.rollback()
-                    continue
-            
-            # Commit all new records
-            if new_count > 0:
-                try:
+            with self.session.get(self.USGS_API_BASE, params=params,
+                                  timeout=30, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                
+                batch = []
+                for feature in ijson.items(response.raw, 'features.item', use_float=True):
+                    batch.append(feature)
+                    if len(batch) >= self.BATCH_SIZE:
+                        new_count += self._store_features(batch)
+                        db.session.commit()
+                        batch = []
+                
+                if batch:
+                    new_count += self._store_features(batch)
                     db.session.commit()
-                except Exception as e:
-                    self.logger.error(f"Error committing earthquakes: {e}")
-                    db.session.rollback()
-                    raise
+            
+            if new_count > 0:
+                # Cached API responses are now stale
+                cache.clear()
             
             self.logger.info(f"Successfully stored {new_count} new earthquakes")
             return new_count
@@ -108,11 +101,126 @@ class EarthquakeService:
             db.session.rollback()
             raise
     
+    def _feature_to_mapping(self, feature):
+        """
+        Convert a USGS GeoJSON feature into an Earthquake insert mapping
+        
+        Returns:
+            Dict of column values, or None if the feature is incomplete
+        """
+        try:
+            # Extract earthquake data
+            properties = feature['properties']
+            geometry = feature['geometry']
+            
+            usgs_id = feature['id']
+            magnitude = properties.get('mag')
+            region = properties.get('place') or 'Unknown'
+            timestamp = datetime.fromtimestamp(properties['time'] / 1000)
+            
+            coordinates = geometry['coordinates']
+            longitude = coordinates[0]
+            latitude = coordinates[1]
+            depth = coordinates[2] if len(coordinates) > 2 else 0
+            
+            if None in (usgs_id, magnitude, latitude, longitude):
+                raise ValueError(f"missing required values in feature {usgs_id}")
+            
+            return {
+                'usgs_id': usgs_id,
+                'latitude': latitude,
+                'longitude': longitude,
+                'magnitude': magnitude,
+                'depth': depth if depth is not None else 0,
+                'region': region,
+                'timestamp': timestamp
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error processing earthquake feature: {e}")
+            return None
+    
+    def _store_features(self, features):
+        """
+        Insert the new earthquakes from a batch of USGS features
+        
+        Returns:
+            Number of earthquakes inserted
+        """
+        # Look up already-stored events in bulk instead of once per feature
+        existing_ids = self._get_existing_usgs_ids(
+            [feature['id'] for feature in features if 'id' in feature]
+        )
+        
+        # Validate features up front so bad records never touch the database
+        mappings = []
+        
+        for feature in features:
+            mapping = self._feature_to_mapping(feature)
+            if mapping is None:
+                continue
+            
+            # Skip earthquakes that are already stored (or repeated in the feed)
+            if mapping['usgs_id'] in existing_ids:
+                continue
+            existing_ids.add(mapping['usgs_id'])
+            
+            mappings.append(mapping)
+        
+        if not mappings:
+            return 0
+        
+        return self._insert_chunk(mappings)
+    
+    def _insert_chunk(self, chunk):
+        """
+        Bulk insert earthquake mappings as a multi-row INSERT statement
+        
+        The chunk runs in a savepoint; if a row is rejected it is retried in
+        halves so a single bad row only costs that row. Other database errors
+        (timeouts, lost connections) are not row-specific and are re-raised.
+        
+        Returns:
+            Number of earthquakes inserted
+        """
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Earthquake), chunk)
+            return len(chunk)
+        except (IntegrityError, DataError) as e:
+            if len(chunk) == 1:
+                self.logger.error(f"Error inserting earthquake {chunk[0]['usgs_id']}: {e}")
+                return 0
+            
+            middle = len(chunk) // 2
+            return self._insert_chunk(chunk[:middle]) + self._insert_chunk(chunk[middle:])
+    
+    def _get_existing_usgs_ids(self, usgs_ids):
+        """Return the subset of usgs_ids already stored"""
+        rows = db.session.query(Earthquake.usgs_id).filter(
+            Earthquake.usgs_id.in_(usgs_ids)
+        ).all()
+        return {row[0] for row in rows}
+    
+    def region_filter(self, region_name):
+        """
+        Case-insensitive substring match on region
+        
+        LIKE wildcards in region_name are escaped so it is matched literally;
+        the resulting ILIKE '%...%' is served by the idx_region_trgm index.
+        """
+        escaped = (
+            region_name.replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_')
+        )
+        return Earthquake.region.ilike(f'%{escaped}%', escape='\\')
+    
     def get_earthquake_by_region(self, region_name, days=30):
         """Get earthquakes for a specific region"""
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         return Earthquake.query.filter(
-            Earthquake.region.ilike(f'%{region_name}%'),
+            self.region_filter(region_name),
             Earthquake.timestamp >= cutoff_date
         ).all()
     
@@ -125,25 +233,33 @@ class EarthquakeService:
         ).order_by(Earthquake.magnitude.desc()).all()
     
     def get_earthquake_statistics(self):
-        """Get basic earthquake statistics"""
-        total = Earthquake.query.count()
-        
+        """Get basic earthquake statistics in a single query"""
         # Recent earthquakes (last 7 days)
         week_ago = datetime.utcnow() - timedelta(days=7)
-        recent = Earthquake.query.filter(Earthquake.timestamp >= week_ago).count()
         
-        # Magnitude distribution
-        major = Earthquake.query.filter(Earthquake.magnitude >= 6.0).count()
-        moderate = Earthquake.query.filter(
-            Earthquake.magnitude >= 4.0,
-            Earthquake.magnitude < 6.0
-        ).count()
-        minor = Earthquake.query.filter(Earthquake.magnitude < 4.0).count()
+        count = func.count(Earthquake.id)
+        stats = db.session.query(
+            count.label('total'),
+            count.filter(Earthquake.timestamp >= week_ago).label('recent'),
+            # Magnitude distribution
+            count.filter(Earthquake.magnitude >= 6.0).label('major'),
+            count.filter(and_(
+                Earthquake.magnitude >= 4.0,
+                Earthquake.magnitude < 6.0
+            )).label('moderate'),
+            count.filter(Earthquake.magnitude < 4.0).label('minor'),
+            func.avg(Earthquake.magnitude).label('average_magnitude')
+        ).one()
         
         return {
-            'total': total,
-            'recent': recent,
-            'major': major,
-            'moderate': moderate,
-            'minor': minor
+            'total': stats.total,
+            'recent': stats.recent,
+            'major': stats.major,
+            'moderate': stats.moderate,
+            'minor': stats.minor,
+            'average_magnitude': float(stats.average_magnitude or 0)
         }
+
+
+# Shared instance so the HTTP session outlives individual requests and jobs
+earthquake_service = EarthquakeService()
@@ -1,6 +1,6 @@
 from app import db
 from datetime import datetime
-from sqlalchemy import Index
+from sqlalchemy import Computed, Index
 
 class Earthquake(db.Model):
     __tablename__ = 'earthquakes'
@@ -15,12 +15,30 @@ class Earthquake(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    # Cell of the default 2-degree risk grid, computed by the database on insert
+    lat_cell_2deg = db.Column(
+        db.SmallInteger,
+        Computed('CAST(floor(latitude / 2.0) AS SMALLINT)', persisted=True)
+    )
+    lon_cell_2deg = db.Column(
+        db.SmallInteger,
+        Computed('CAST(floor(longitude / 2.0) AS SMALLINT)', persisted=True)
+    )
+    
     # Add indexes for common queries
     __table_args__ = (
-        Index('idx_magnitude', 'magnitude'),
-        Index('idx_timestamp', 'timestamp'),
+        # Time window filters, optionally narrowed by magnitude
+        Index('idx_ts_mag', 'timestamp', 'magnitude'),
         Index('idx_location', 'latitude', 'longitude'),
-        Index('idx_region', 'region'),
+        # Covers the risk zone aggregation (a year of rows grouped by grid
+        # cell) so it can be answered with an index-only scan
+        Index('idx_ts_cells', 'timestamp',
+              postgresql_include=['lat_cell_2deg', 'lon_cell_2deg',
+                                  'magnitude', 'depth', 'region']),
+        # Trigram index so region ILIKE '%...%' searches can use an index
+        Index('idx_region_trgm', 'region',
+              postgresql_using='gin',
+              postgresql_ops={'region': 'gin_trgm_ops'}),
     )
     
     def to_dict(self):
@@ -32,19 +50,10 @@ class Earthquake(db.Model):
             'magnitude': self.magnitude,
             'depth': self.depth,
             'region': self.region,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'timestamp': self.timestamp,
+            'created_at': self.created_at
         }
     
-    def get_magnitude_color(self):
-        """Return color code based on magnitude"""
-        if self.magnitude < 4.0:
-            return 'green'
-        elif self.magnitude < 6.0:
-            return 'yellow'
-        else:
-            return 'red'
-    
     def __repr__(self):
         return f'<Earthquake {self.usgs_id}: M{self.magnitude} at {self.region}>'
 
@@ -59,6 +68,11 @@ class RiskZone(db.Model):
     earthquake_count = db.Column(db.Integer, default=0)
     last_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    # One zone per grid cell; update_risk_zones upserts on this key
+    __table_args__ = (
+        Index('idx_risk_zone_location', 'latitude', 'longitude', unique=True),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -67,7 +81,7 @@ class RiskZone(db.Model):
             'risk_level': self.risk_level,
             'region_name': self.region_name,
             'earthquake_count': self.earthquake_count,
-            'last_updated': self.last_updated.isoformat() if self.last_updated else None
+            'last_updated': self.last_updated
         }
     
     def __repr__(self):
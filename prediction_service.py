@@ -1,10 +1,9 @@
 import logging
 from datetime import datetime, timedelta
-from collections import defaultdict
-import math
-from app import db
+from app import db, cache
 from models import Earthquake, RiskZone
-from sqlalchemy import func
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 class PredictionService:
     """Service for earthquake prediction and risk assessment"""
@@ -12,6 +11,57 @@ class PredictionService:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
     
+    # Risk zones for every grid cell, scored in one set-based pass:
+    # per-cell aggregates -> risk factors -> weighted risk level
+    # {lat_index}/{lon_index} are the integer cell coordinates of each row
+    RISK_ZONES_SQL = """
+        SELECT (lat_cell + :grid_size / 2)::float AS latitude,
+               (lon_cell + :grid_size / 2)::float AS longitude,
+               risk_level,
+               region_name,
+               earthquake_count
+        FROM (
+            SELECT lat_cell,
+                   lon_cell,
+                   earthquake_count,
+                   coalesce(region_name, 'Unknown Region') AS region_name,
+                   least(
+                       frequency_score * 0.3 +
+                       magnitude_score * 0.4 +
+                       recency_score * 0.2 +
+                       depth_score * 0.1,
+                       1.0
+                   )::float AS risk_level
+            FROM (
+                SELECT lat_cell,
+                       lon_cell,
+                       earthquake_count,
+                       region_name,
+                       least(earthquake_count / 12.0 / 10.0, 1.0) AS frequency_score,
+                       greatest(least((avg_magnitude - 2.0) / 6.0, 1.0), 0.0)
+                           * CASE WHEN max_magnitude >= 6.0 THEN 1.5 ELSE 1.0 END AS magnitude_score,
+                       recent_count::float / earthquake_count AS recency_score,
+                       CASE WHEN avg_depth > 0 THEN greatest((70 - avg_depth) / 70, 0.0)
+                            ELSE 0.5 END AS depth_score
+                FROM (
+                    SELECT {lat_index} * :grid_size AS lat_cell,
+                           {lon_index} * :grid_size AS lon_cell,
+                           count(*) AS earthquake_count,
+                           avg(magnitude) AS avg_magnitude,
+                           max(magnitude) AS max_magnitude,
+                           avg(depth) AS avg_depth,
+                           count(*) FILTER (WHERE timestamp >= :recent_cutoff) AS recent_count,
+                           mode() WITHIN GROUP (ORDER BY region) AS region_name
+                    FROM earthquakes
+                    WHERE timestamp >= :cutoff
+                    GROUP BY {lat_index}, {lon_index}
+                    HAVING count(*) >= :min_earthquakes
+                ) AS cells
+            ) AS factors
+        ) AS scored
+        WHERE risk_level > :min_risk
+    """
+    
     def update_risk_zones(self, grid_size=2.0):
         """
         Update risk zones based on historical earthquake activity
@@ -23,138 +73,85 @@ class PredictionService:
             Number of risk zones updated
         """
         try:
-            # Clear existing risk zones
-            RiskZone.query.delete()
-            
-            # Get historical earthquake data (last 365 days)
-            cutoff_date = datetime.utcnow() - timedelta(days=365)
-            earthquakes = Earthquake.query.filter(
-                Earthquake.timestamp >= cutoff_date
-            ).all()
-            
-            if not earthquakes:
-                self.logger.warning("No earthquake data available for risk assessment")
-                return 0
-            
-            # Group earthquakes into grid cells
-            grid_cells = defaultdict(list)
-            
-            for eq in earthquakes:
-                # Calculate grid cell coordinates
-                lat_cell = math.floor(eq.latitude / grid_size) * grid_size
-                lon_cell = math.floor(eq.longitude / grid_size) * grid_size
-                
-                grid_cells[(lat_cell, lon_cell)].append(eq)
-            
-            zones_created = 0
-            
-            for (lat, lon), cell_earthquakes in grid_cells.items():
-                if len(cell_earthquakes) < 3:  # Minimum earthquakes for risk assessment
-                    continue
-                
-                # Calculate risk metrics
-                risk_level = self._calculate_risk_level(cell_earthquakes)
-                
-                # Only create zones with significant risk
-                if risk_level > 0.3:
-                    # Get representative region name
-                    region_name = self._get_representative_region(cell_earthquakes)
-                    
-                    # Calculate center point of grid cell
-                    center_lat = lat + grid_size / 2
-                    center_lon = lon + grid_size / 2
-                    
-                    risk_zone = RiskZone(
-                        latitude=center_lat,
-                        longitude=center_lon,
-                        risk_level=risk_level,
-                        region_name=region_name,
-                        earthquake_count=len(cell_earthquakes),
-                        last_updated=datetime.utcnow()
-                    )
-                    
-                    db.session.add(risk_zone)
-                    zones_created += 1
+            now = datetime.utcnow()
+            cutoff = now - timedelta(days=365)
+            
+            if db.session.get_bind().dialect.name == "postgresql":
+                # The year-long aggregate can outlast the 5 s API statement timeout
+                db.session.execute(text("SET LOCAL statement_timeout = 60000"))
+            
+            if grid_size == 2.0:
+                # Default grid: use the cell columns precomputed at insert time
+                cell_index = {'lat_index': 'lat_cell_2deg', 'lon_index': 'lon_cell_2deg'}
+            else:
+                cell_index = {
+                    'lat_index': 'floor(latitude / :grid_size)',
+                    'lon_index': 'floor(longitude / :grid_size)'
+                }
+            
+            # Score historical earthquake data (last 365 days) per grid cell;
+            # "recent" spans 90 whole days, i.e. anything under 91 days old
+            query = text(self.RISK_ZONES_SQL.format(**cell_index))
+            result = db.session.execute(query, {
+                'grid_size': grid_size,
+                'cutoff': cutoff,
+                'recent_cutoff': now - timedelta(days=91),
+                'min_earthquakes': 3,  # Minimum earthquakes for risk assessment
+                'min_risk': 0.3  # Only create zones with significant risk
+            })
+            zones = [dict(row, last_updated=now) for row in result.mappings()]
+            
+            if not zones:
+                # The query drops low-risk cells, so check whether there was any data at all
+                has_data = db.session.query(
+                    select(Earthquake.id).where(Earthquake.timestamp >= cutoff).exists()
+                ).scalar()
+                if has_data:
+                    self.logger.info("No grid cells above the risk threshold")
+                else:
+                    self.logger.warning("No earthquake data available for risk assessment")
+            
+            # Update zones in place, keyed on their grid cell center
+            if zones:
+                stmt = pg_insert(RiskZone)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[RiskZone.latitude, RiskZone.longitude],
+                    set_={
+                        'risk_level': stmt.excluded.risk_level,
+                        'region_name': stmt.excluded.region_name,
+                        'earthquake_count': stmt.excluded.earthquake_count,
+                        'last_updated': stmt.excluded.last_updated
+                    }
+                )
+                db.session.execute(stmt, zones)
+            
+            # Remove zones whose cells no longer qualify
+            db.session.execute(delete(RiskZone).where(RiskZone.last_updated < now))
             
             db.session.commit()
-            self.logger.info(f"Created {zones_created} risk zones")
-            return zones_created
+            cache.clear()
+            self.logger.info(f"Updated {len(zones)} risk zones")
+            return len(zones)
             
         except Exception as e:
             self.logger.error(f"Error updating risk zones: {e}")
             db.session.rollback()
             raise
     
-    def _calculate_risk_level(self, earthquakes):
-        """
-        Calculate risk level for a group of earthquakes
-        
-        Risk factors considered:
-        - Frequency of earthquakes
-        - Average magnitude
-        - Recent activity
-        - Depth patterns
-        """
-        if not earthquakes:
-            return 0.0
-        
-        # Frequency factor (earthquakes per month)
-        frequency = len(earthquakes) / 12.0  # Assuming 1 year of data
-        frequency_score = min(frequency / 10.0, 1.0)  # Normalize to 0-1
-        
-        # Magnitude factor
-        magnitudes = [eq.magnitude for eq in earthquakes if eq.magnitude]
-        if magnitudes:
-            avg_magnitude = sum(magnitudes) / len(magnitudes)
-            max_magnitude = max(magnitudes)
-            magnitude_score = min((avg_magnitude - 2.0) / 6.0, 1.0)  # Scale 2-8 to 0-1
-            magnitude_score = max(magnitude_score, 0.0)
-            
-            # Boost for high maximum magnitude
-            if max_magnitude >= 6.0:
-                magnitude_score *= 1.5
-        else:
-            magnitude_score = 0.0
-        
-        # Recent activity factor (more recent = higher risk)
-        now = datetime.utcnow()
-        recent_earthquakes = [
-            eq for eq in earthquakes 
-            if (now - eq.timestamp).days <= 90
-        ]
-        recency_score = len(recent_earthquakes) / len(earthquakes)
-        
-        # Depth factor (shallower earthquakes are more dangerous)
-        depths = [eq.depth for eq in earthquakes if eq.depth is not None]
-        if depths:
-            avg_depth = sum(depths) / len(depths)
-            # Shallow earthquakes (< 70km) are more dangerous
-            depth_score = max(0, (70 - avg_depth) / 70) if avg_depth > 0 else 0.5
-        else:
-            depth_score = 0.5
-        
-        # Combine factors with weights
-        risk_level = (
-            frequency_score * 0.3 +
-            magnitude_score * 0.4 +
-            recency_score * 0.2 +
-            depth_score * 0.1
-        )
-        
-        return min(risk_level, 1.0)
-    
-    def _get_representative_region(self, earthquakes):
-        """Get the most common region name from a group of earthquakes"""
-        region_counts = defaultdict(int)
-        
-        for eq in earthquakes:
-            if eq.region:
-                region_counts[eq.region] += 1
-        
-        if region_counts:
-            return max(region_counts.items(), key=lambda x: x[1])[0]
-        
-        return "Unknown Region"
+    def get_risk_zones(self, min_risk=0.3):
+        """Get risk zones above min_risk as plain dicts, without ORM objects"""
+        rows = db.session.execute(
+            select(
+                RiskZone.id,
+                RiskZone.latitude,
+                RiskZone.longitude,
+                RiskZone.risk_level,
+                RiskZone.region_name,
+                RiskZone.earthquake_count,
+                RiskZone.last_updated
+            ).where(RiskZone.risk_level > min_risk)
+        ).mappings()
+        return [dict(row) for row in rows]
     
     def get_high_risk_regions(self, min_risk=0.7):
         """Get regions with high earthquake risk"""
@@ -171,35 +168,35 @@ class PredictionService:
             # Convert radius to approximate degrees
             radius_deg = radius_km / 111.0  # Rough conversion
             
-            # Get historical earthquakes in the region
-            earthquakes = Earthquake.query.filter(
-                func.abs(Earthquake.latitude - latitude) <= radius_deg,
-                func.abs(Earthquake.longitude - longitude) <= radius_deg
-            ).all()
-            
-            if len(earthquakes) < 5:
+            # Count historical and recent earthquakes in the region; plain
+            # range predicates let the (latitude, longitude) index be used.
+            # "Recent" spans 30 whole days, i.e. anything under 31 days old
+            recent_cutoff = datetime.utcnow() - timedelta(days=31)
+            event_count, recent_count = db.session.query(
+                func.count(Earthquake.id),
+                func.count(Earthquake.id).filter(Earthquake.timestamp >= recent_cutoff)
+            ).filter(
+                Earthquake.latitude.between(latitude - radius_deg, latitude + radius_deg),
+                Earthquake.longitude.between(longitude - radius_deg, longitude + radius_deg)
+            ).one()
+            
+            if event_count < 5:
                 return {
                     'probability': 0.1,
                     'confidence': 'low',
-                    'based_on_events': len(earthquakes)
+                    'based_on_events': event_count
                 }
             
-            # Analyze patterns
-            recent_earthquakes = [
-                eq for eq in earthquakes
-                if (datetime.utcnow() - eq.timestamp).days <= 30
-            ]
-            
             # Simple probability calculation based on historical frequency
-            historical_frequency = len(earthquakes) / 365.0  # earthquakes per day
-            recent_activity_boost = len(recent_earthquakes) * 0.1
+            historical_frequency = event_count / 365.0  # earthquakes per day
+            recent_activity_boost = recent_count * 0.1
             
             probability = min(historical_frequency + recent_activity_boost, 1.0)
             
             # Determine confidence level
-            if len(earthquakes) > 50:
+            if event_count > 50:
                 confidence = 'high'
-            elif len(earthquakes) > 20:
+            elif event_count > 20:
                 confidence = 'medium'
             else:
                 confidence = 'low'
@@ -207,8 +204,8 @@ class PredictionService:
             return {
                 'probability': round(probability, 3),
                 'confidence': confidence,
-                'based_on_events': len(earthquakes),
-                'recent_activity': len(recent_earthquakes)
+                'based_on_events': event_count,
+                'recent_activity': recent_count
             }
             
         except Exception as e:
@@ -1,12 +1,56 @@
-from flask import render_template, request, jsonify, redirect, url_for, flash
-from app import app, db
-from models import Earthquake, RiskZone
-from earthquake_service import EarthquakeService
+from flask import render_template, request, redirect, url_for, flash
+from app import app, db, cache
+from models import Earthquake
+from earthquake_service import earthquake_service
 from prediction_service import PredictionService
 from datetime import datetime, timedelta
-from sqlalchemy import and_, or_
+from sqlalchemy import case, or_, select, tuple_
+import base64
 import logging
 
+# Columns returned by /api/earthquakes, matching Earthquake.to_dict()
+EARTHQUAKE_COLUMNS = (
+    Earthquake.id,
+    Earthquake.usgs_id,
+    Earthquake.latitude,
+    Earthquake.longitude,
+    Earthquake.magnitude,
+    Earthquake.depth,
+    Earthquake.region,
+    Earthquake.timestamp,
+    Earthquake.created_at,
+)
+
+MAX_PAGE_SIZE = 500
+
+# Badge color for the admin table, computed by the database
+MAGNITUDE_COLOR = case(
+    (Earthquake.magnitude < 4.0, 'green'),
+    (Earthquake.magnitude < 6.0, 'yellow'),
+    else_='red'
+).label('color')
+
+def _encode_cursor(timestamp, earthquake_id):
+    """Encode the (timestamp, id) keyset position of a row as an opaque token"""
+    position = f"{timestamp.isoformat()}|{earthquake_id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def _decode_cursor(cursor):
+    """Decode a cursor token; raises ValueError if it is malformed"""
+    position = base64.urlsafe_b64decode(cursor.encode()).decode()
+    timestamp, earthquake_id = position.split('|')
+    return datetime.fromisoformat(timestamp), int(earthquake_id)
+
+def json_response(payload, status=200):
+    """Serialize an API payload with the app's orjson provider"""
+    response = app.json.response(payload)
+    response.status_code = status
+    return response
+
+def _is_cacheable(rv):
+    """Keep error responses out of the API cache"""
+    return app.make_response(rv).status_code == 200
+
 @app.route('/')
 def index():
     """Main dashboard page"""
@@ -15,18 +59,29 @@ def index():
 @app.route('/admin')
 def admin():
     """Admin panel for data management"""
-    earthquakes = Earthquake.query.order_by(Earthquake.timestamp.desc()).limit(50).all()
-    total_earthquakes = Earthquake.query.count()
-    recent_earthquakes = Earthquake.query.filter(
-        Earthquake.timestamp >= datetime.utcnow() - timedelta(days=7)
-    ).count()
+    # Only the columns the table shows, as plain rows rather than ORM objects
+    earthquakes = db.session.execute(
+        select(
+            Earthquake.id,
+            Earthquake.usgs_id,
+            Earthquake.magnitude,
+            Earthquake.latitude,
+            Earthquake.longitude,
+            Earthquake.depth,
+            Earthquake.region,
+            Earthquake.timestamp,
+            MAGNITUDE_COLOR
+        ).order_by(Earthquake.timestamp.desc()).limit(50)
+    ).mappings().all()
+    stats = earthquake_service.get_earthquake_statistics()
     
     return render_template('admin.html', 
                          earthquakes=earthquakes,
-                         total_earthquakes=total_earthquakes,
-                         recent_earthquakes=recent_earthquakes)
+                         total_earthquakes=stats['total'],
+                         recent_earthquakes=stats['recent'])
 
 @app.route('/api/earthquakes')
+@cache.cached(timeout=120, query_string=True, response_filter=_is_cacheable)
 def api_earthquakes():
     """API endpoint to get earthquake data with filtering"""
     try:
@@ -35,66 +90,86 @@ def api_earthquakes():
         magnitude_max = request.args.get('magnitude_max', type=float)
         region = request.args.get('region')
         days = request.args.get('days', default=30, type=int)
-        limit = request.args.get('limit', default=1000, type=int)
+        page_size = request.args.get('page_size', default=100, type=int)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor')
         
-        # Build query
-        query = Earthquake.query
+        # Build query over plain columns; rows are serialized as-is
+        query = select(*EARTHQUAKE_COLUMNS)
         
         # Filter by time period
         if days > 0:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
-            query = query.filter(Earthquake.timestamp >= cutoff_date)
+            query = query.where(Earthquake.timestamp >= cutoff_date)
         
         # Filter by magnitude
         if magnitude_min is not None:
-            query = query.filter(Earthquake.magnitude >= magnitude_min)
+            query = query.where(Earthquake.magnitude >= magnitude_min)
         if magnitude_max is not None:
-            query = query.filter(Earthquake.magnitude <= magnitude_max)
+            query = query.where(Earthquake.magnitude <= magnitude_max)
         
         # Filter by region
         if region:
-            query = query.filter(Earthquake.region.ilike(f'%{region}%'))
+            query = query.where(earthquake_service.region_filter(region))
+        
+        # Continue after the last row of the previous page
+        if cursor:
+            try:
+                cursor_timestamp, cursor_id = _decode_cursor(cursor)
+            except ValueError:
+                return json_response({'success': False, 'error': 'Invalid cursor'}, status=400)
+            query = query.where(
+                tuple_(Earthquake.timestamp, Earthquake.id) < tuple_(cursor_timestamp, cursor_id)
+            )
+        
+        # Execute query, fetching one extra row to know if another page exists
+        rows = db.session.execute(
+            query.order_by(Earthquake.timestamp.desc(), Earthquake.id.desc())
+            .limit(page_size + 1)
+        ).mappings().all()
         
-        # Execute query
-        earthquakes = query.order_by(Earthquake.timestamp.desc()).limit(limit).all()
+        earthquakes = [dict(row) for row in rows[:page_size]]
+        next_cursor = None
+        if len(rows) > page_size:
+            next_cursor = _encode_cursor(earthquakes[-1]['timestamp'], earthquakes[-1]['id'])
         
-        return jsonify({
+        return json_response({
             'success': True,
-            'earthquakes': [eq.to_dict() for eq in earthquakes],
-            'count': len(earthquakes)
+            'earthquakes': earthquakes,
+            'count': len(earthquakes),
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         app.logger.error(f"Error fetching earthquakes: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, status=500)
 
 @app.route('/api/risk-zones')
+@cache.cached(timeout=120, query_string=True, response_filter=_is_cacheable)
 def api_risk_zones():
     """API endpoint to get risk zone data"""
     try:
-        risk_zones = RiskZone.query.filter(RiskZone.risk_level > 0.3).all()
-        return jsonify({
+        return json_response({
             'success': True,
-            'risk_zones': [zone.to_dict() for zone in risk_zones]
+            'risk_zones': PredictionService().get_risk_zones(min_risk=0.3)
         })
     except Exception as e:
         app.logger.error(f"Error fetching risk zones: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, status=500)
 
 @app.route('/api/fetch-data', methods=['POST'])
 def api_fetch_data():
     """Manually trigger earthquake data fetch"""
     try:
-        service = EarthquakeService()
-        count = service.fetch_and_store_earthquakes()
-        return jsonify({
+        count = earthquake_service.fetch_and_store_earthquakes()
+        return json_response({
             'success': True,
             'message': f'Successfully fetched {count} new earthquakes',
             'count': count
         })
     except Exception as e:
         app.logger.error(f"Error fetching earthquake data: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, status=500)
 
 @app.route('/api/update-predictions', methods=['POST'])
 def api_update_predictions():
@@ -102,64 +177,49 @@ def api_update_predictions():
     try:
         prediction_service = PredictionService()
         zones_updated = prediction_service.update_risk_zones()
-        return jsonify({
+        return json_response({
             'success': True,
             'message': f'Updated {zones_updated} risk zones',
             'zones_updated': zones_updated
         })
     except Exception as e:
         app.logger.error(f"Error updating predictions: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, status=500)
 
 @app.route('/api/earthquake/<int:earthquake_id>')
 def api_earthquake_detail(earthquake_id):
     """Get detailed information about a specific earthquake"""
     try:
         earthquake = Earthquake.query.get_or_404(earthquake_id)
-        return jsonify({
+        return json_response({
             'success': True,
             'earthquake': earthquake.to_dict()
         })
     except Exception as e:
         app.logger.error(f"Error fetching earthquake detail: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, status=500)
 
 @app.route('/api/statistics')
+@cache.cached(timeout=120, query_string=True, response_filter=_is_cacheable)
 def api_statistics():
     """Get earthquake statistics"""
     try:
-        total = Earthquake.query.count()
-        
-        # Recent earthquakes (last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent = Earthquake.query.filter(Earthquake.timestamp >= week_ago).count()
-        
-        # Magnitude distribution
-        major = Earthquake.query.filter(Earthquake.magnitude >= 6.0).count()
-        moderate = Earthquake.query.filter(and_(
-            Earthquake.magnitude >= 4.0,
-            Earthquake.magnitude < 6.0
-        )).count()
-        minor = Earthquake.query.filter(Earthquake.magnitude < 4.0).count()
-        
-        # Average magnitude
-        from sqlalchemy import func
-        avg_magnitude = db.session.query(func.avg(Earthquake.magnitude)).scalar()
+        stats = earthquake_service.get_earthquake_statistics()
         
-        return jsonify({
+        return json_response({
             'success': True,
             'statistics': {
-                'total_earthquakes': total,
-                'recent_earthquakes': recent,
-                'major_earthquakes': major,
-                'moderate_earthquakes': moderate,
-                'minor_earthquakes': minor,
-                'average_magnitude': round(float(avg_magnitude or 0), 2)
+                'total_earthquakes': stats['total'],
+                'recent_earthquakes': stats['recent'],
+                'major_earthquakes': stats['major'],
+                'moderate_earthquakes': stats['moderate'],
+                'minor_earthquakes': stats['minor'],
+                'average_magnitude': round(stats['average_magnitude'], 2)
             }
         })
     except Exception as e:
         app.logger.error(f"Error fetching statistics: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, status=500)
 
 @app.route('/admin/earthquake/<int:earthquake_id>/delete', methods=['POST'])
 def admin_delete_earthquake(earthquake_id):
@@ -168,6 +228,7 @@ def admin_delete_earthquake(earthquake_id):
         earthquake = Earthquake.query.get_or_404(earthquake_id)
         db.session.delete(earthquake)
         db.session.commit()
+        cache.clear()
         flash(f'Earthquake {earthquake.usgs_id} deleted successfully', 'success')
     except Exception as e:
         app.logger.error(f"Error deleting earthquake: {e}")
@@ -28,23 +28,38 @@ function initializeEarthquakeMap() {
             if (filters.minMagnitude) params.append('magnitude_min', filters.minMagnitude);
             if (filters.maxMagnitude) params.append('magnitude_max', filters.maxMagnitude);
             if (filters.region) params.append('region', filters.region);
+            params.append('page_size', 500);
             
-            fetch(`/api/earthquakes?${params}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        this.displayEarthquakes(data.earthquakes);
-                        this.updateRecentEarthquakesList(data.earthquakes);
-                        this.updateLastUpdateTime();
-                    } else {
-                        console.error('Error loading earthquakes:', data.error);
-                    }
+            this.fetchEarthquakePages(params, [])
+                .then(earthquakes => {
+                    this.displayEarthquakes(earthquakes);
+                    this.updateRecentEarthquakesList(earthquakes);
+                    this.updateLastUpdateTime();
                 })
                 .catch(error => {
                     console.error('Error fetching earthquake data:', error);
                 });
         },
         
+        fetchEarthquakePages: function(params, earthquakes) {
+            // Follow the API cursor until all pages (or 1000 earthquakes) are loaded
+            return fetch(`/api/earthquakes?${params}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        throw new Error(data.error);
+                    }
+                    
+                    earthquakes = earthquakes.concat(data.earthquakes);
+                    if (!data.next_cursor || earthquakes.length >= 1000) {
+                        return earthquakes;
+                    }
+                    
+                    params.set('cursor', data.next_cursor);
+                    return this.fetchEarthquakePages(params, earthquakes);
+                });
+        },
+        
         displayEarthquakes: function(earthquakes) {
             // Clear existing markers
             earthquakeMarkers.forEach(marker => this.map.removeLayer(marker));